@@ -18,6 +18,13 @@ class DataCollectionConfig:
         self.continueDownload = False           # if true, the already downloaded data is skipped
         self.subreddits = list()                # list of subreddits to use for downloading
         self.outputDirectory = str()            # output directory to download the data to
+        self.batchedQuery = False               # if true, all subreddits are queried together in each epoch
+        self.quotaDistribution = 'sequential'   # distribution of the epoch quota in batched query: 'sequential' or 'even'
+        self.thumbnailFirst = False             # if true, thumbnails are processed and full images downloaded only for OCR
+        self.deferredRetryTimeout = 10          # minutes to retry deferred posts after the last epoch
+        self.tailPollInterval = 60              # seconds between two polls of the subreddits in tail mode
+        self.tailFlushInterval = 300            # maximum number of seconds new posts are buffered in tail mode
+        self.tailFlushSize = 100                # number of buffered posts triggering a write in tail mode
 
 
     def setDateInterval(self, startDateStr: str, endDateStr: str):
@@ -78,15 +85,11 @@ class DataCollectionConfig:
         '''
         Remove those epocs that are already downloaded.
 
-        Help to continue data collection after it stopped.
+        Help to continue data collection after it stopped. Output files are written atomically,
+        so every existing file is complete, partially downloaded epochs only have checkpoints.
         '''
         existingFileNames = [fileName for fileName in listdir(outputDirectory) if fileName.endswith('.csv')]
 
-        if 0 != len(existingFileNames):
-            # last file is probably only partially downloaded, remove that
-            existingFileNames.sort()
-            existingFileNames.pop()
-
         listOfDownloadedEpochs = []
 
         for fileName in existingFileNames:
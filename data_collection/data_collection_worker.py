@@ -4,14 +4,19 @@ import pandas as pd
 import datetime as dt
 from threading import Thread, Lock
 import os
+import shutil
+import time
 
 from reddit_interface import Reddit
+from image_fetcher import ImageFetcher
 
 # ONLINE PROCESSING
 # from online_processing.ocr import OCR
 # from online_processing.colours import Colours
-# from online_processing.imagecontent.imageai import ImageAIClassifier
 # from online_processing.imagecontent.efficientnet import EfficientNetClassifier
+# from online_processing.imagecontent.cascade import CascadeClassifier
+# from online_processing.imagecontent.embeddingstore import EmbeddingStore
+# from online_processing.thumbnailtier import ThumbnailFirstProcessor
 
 
 class DataCollectionWorker(Thread):
@@ -26,31 +31,46 @@ class DataCollectionWorker(Thread):
     _subReddits = []
     _numOfEpochs = 0
     _outputDirectory = ''
+    _batchedQuery = False
+    _quotaDistribution = 'sequential'
+    _thumbnailFirst = False
+    _embeddingStore = None  # static store of image embeddings shared by the workers
+    _retryingEpochs = set() # static set of epoch names whose deferred posts are being retried by a worker
+    _imageClassifiers = []  # static list of the image classifiers of the workers, for their statistics
 
 
     def __init__(self, threadId: int, token, queue = None):
 
         self._threadId = threadId
-        self._interface = Reddit(token)
+        self._interface = Reddit(token, self._thumbnailFirst)
         self._collectedData = None
 
         # ONLINE PROCESSING
         # self._ocr = OCR()
         # self._colours = Colours()
-        # self._imageClassifier = EfficientNetClassifier(5)  # ImageAIClassifier()
+        # self._imageClassifier = CascadeClassifier((0, 5), 0.5)  # EfficientNetClassifier(5), the classifier has to embed the images
+        # self._thumbnailProcessor = ThumbnailFirstProcessor(self._ocr, self._colours, self._imageClassifier,
+        #                                                   self._embeddingStore)
+        # DataCollectionWorker._imageClassifiers.append(self._imageClassifier)
 
         Thread.__init__(self)  # base class constructor
         self._queue = queue
 
 
     @classmethod
-    def initialize(cls, subReddits: list, outputDirectory: str):
+    def initialize(cls, subReddits: list, outputDirectory: str,
+                   batchedQuery: bool = False, quotaDistribution: str = 'sequential',
+                   thumbnailFirst: bool = False):
         cls._subReddits = subReddits
         cls._outputDirectory = outputDirectory
+        cls._batchedQuery = batchedQuery
+        cls._quotaDistribution = quotaDistribution
+        cls._thumbnailFirst = thumbnailFirst
         cls._startTime = dt.datetime.now()
 
         # ONLINE PROCESSING
         # Colours.initializeColourRanges()
+        # cls._embeddingStore = EmbeddingStore(os.path.join(outputDirectory, 'embeddings'))
 
         if not os.path.exists(DataCollectionWorker._outputDirectory):
             os.makedirs(DataCollectionWorker._outputDirectory)
@@ -70,12 +90,12 @@ class DataCollectionWorker(Thread):
                 postAttributes = self._collect(epoch)
 
                 if not postAttributes.empty:  # some images found
-                    # ONLINE PROCESSING
-                    # processedAttributes = self._process(postAttributes)
-                    # DataCollectionWorker._save(epoch, processedAttributes)
-
                     DataCollectionWorker._save(epoch, postAttributes)
 
+                DataCollectionWorker._removeCheckpoints(epoch)
+
+                self.retryDeferredPosts()
+
                 with DataCollectionWorker._lock:
                     DataCollectionWorker._processedEpochsInTotal += 1
                     DataCollectionWorker._processedEpochsInThisRun += 1
@@ -87,20 +107,21 @@ class DataCollectionWorker(Thread):
 
 
     def _collect(self, epoch):
-        listOfPostAttributes = []
+        '''
+        Collect and process the posts of the epoch.
 
-        remainingMemesToDownload = epoch['numOfPosts']
-        for subReddit in self._subReddits:
-            epoch['numOfPosts'] = remainingMemesToDownload
-            postAttributes = self._interface.getPosts(subReddit, epoch)
+        Every processed chunk of posts is written to a checkpoint, chunks checkpointed by
+        an earlier, interrupted run are loaded instead of being downloaded again.
+        '''
+        checkpoints = DataCollectionWorker._loadCheckpoints(epoch)
+        listOfPostAttributes = [postAttributes for _, postAttributes in checkpoints if not postAttributes.empty]
 
-            numCollectedMemes = len(postAttributes)
-            if 0 != numCollectedMemes:
-                listOfPostAttributes.append(postAttributes)
+        if self._batchedQuery:
+            listOfPostAttributes.extend(self._collectBatched(epoch, checkpoints))
+        else:
+            listOfPostAttributes.extend(self._collectSubredditBySubreddit(epoch, checkpoints))
 
-            remainingMemesToDownload -= numCollectedMemes
-            if remainingMemesToDownload <= 0:
-                break
+        self._queueDeferredPosts(epoch)  # deferred after the last checkpoint
 
         if listOfPostAttributes:
             postAttributes = pd.concat(listOfPostAttributes, ignore_index=True)
@@ -110,10 +131,166 @@ class DataCollectionWorker(Thread):
         return postAttributes
 
 
+    def _collectSubredditBySubreddit(self, epoch, checkpoints: list) -> list:
+        '''
+        Query the subreddits one after the other until the quota of the epoch is filled.
+
+        Subreddits with a checkpoint are not queried again, their posts count against the quota.
+        Posts checkpointed by a batched run also count against the quota, and are skipped when
+        their subreddit is queried.
+        '''
+        listOfPostAttributes = []
+        checkpointedPosts = {label: postAttributes for label, postAttributes in checkpoints if 'batch' != label}
+        batchedPosts = [postAttributes for label, postAttributes in checkpoints
+                        if 'batch' == label and not postAttributes.empty]
+        batchedPosts = pd.concat(batchedPosts, ignore_index=True) if batchedPosts else pd.DataFrame(columns=['id', 'subreddit'])
+
+        remainingMemesToDownload = epoch['numOfPosts'] - len(batchedPosts)
+        for subReddit in self._subReddits:
+            if remainingMemesToDownload <= 0:
+                break
+
+            if subReddit in checkpointedPosts:
+                remainingMemesToDownload -= len(checkpointedPosts[subReddit])
+            else:
+                batchedPostsOfSubReddit = batchedPosts[batchedPosts['subreddit'].str[len('r/'):].str.lower() == subReddit]
+                seenPosts = dict.fromkeys(batchedPostsOfSubReddit['id'])
+
+                epoch['numOfPosts'] = remainingMemesToDownload + len(seenPosts)  # skipped posts do not use up the limit
+                postAttributes = self._interface.getPosts(subReddit, epoch, seenPosts=seenPosts)
+                self._queueDeferredPosts(epoch)
+                postAttributes = self._checkpoint(epoch, subReddit, self._processChunk(postAttributes))
+
+                numCollectedMemes = len(postAttributes)
+                listOfPostAttributes.append(postAttributes)
+                remainingMemesToDownload -= numCollectedMemes
+
+        return [postAttributes for postAttributes in listOfPostAttributes if not postAttributes.empty]
+
+
+    def _collectBatched(self, epoch, checkpoints: list) -> list:
+        '''
+        Query all subreddits together, checkpoint the downloaded posts chunk by chunk.
+        '''
+        listOfPostAttributes = []
+        downloadedIds = {postId for _, postAttributes in checkpoints if not postAttributes.empty
+                         for postId in postAttributes['id']}
+
+        for postAttributes in self._interface.getPostChunksFromSubreddits(self._subReddits, epoch,
+                                                                           self._quotaDistribution, downloadedIds):
+            self._queueDeferredPosts(epoch)
+            postAttributes = self._checkpoint(epoch, 'batch', self._processChunk(postAttributes))
+            listOfPostAttributes.append(postAttributes)
+
+        return listOfPostAttributes
+
+
+    def retryDeferredPosts(self) -> int:
+        '''
+        Retry the deferred posts of all epochs, download those whose host is available again.
+
+        Recovered posts are processed and written into the deferred output file of their epoch,
+        so they neither change the file nor the quota of the epoch being collected.
+        Return the number of posts which are still deferred.
+        '''
+        with DataCollectionWorker._lock:
+            epochNames = [epochName for epochName in DataCollectionWorker._getDeferredEpochNames()
+                          if epochName not in DataCollectionWorker._retryingEpochs]
+            DataCollectionWorker._retryingEpochs.update(epochNames)
+
+        try:
+            return sum(self._retryDeferredPostsOfEpoch(epochName) for epochName in epochNames)
+        finally:
+            with DataCollectionWorker._lock:
+                DataCollectionWorker._retryingEpochs.difference_update(epochNames)
+
+
+    def _retryDeferredPostsOfEpoch(self, epochName: str) -> int:
+        '''
+        Retry the deferred posts of one epoch, return the number of its posts which are still deferred.
+        '''
+        with DataCollectionWorker._lock:
+            queuedPosts = DataCollectionWorker._readDeferredPosts(epochName)
+
+        if queuedPosts.empty:
+            return 0
+
+        recoveredPosts = self._processChunk(self._interface.retryDeferredPosts(queuedPosts))
+        stillDeferredPosts = self._interface.takeDeferredPosts()
+
+        # posts which were downloaded, turned out to be unavailable or were given up leave the queue,
+        # the others are queued again with their attempts counted
+        retriedIds = set(queuedPosts['id'])
+
+        with DataCollectionWorker._lock:
+            if not recoveredPosts.empty:
+                DataCollectionWorker._saveRecoveredPosts(epochName, recoveredPosts)
+
+            queuedPosts = DataCollectionWorker._readDeferredPosts(epochName)  # may have grown meanwhile
+            if not queuedPosts.empty:
+                queuedPosts = queuedPosts[~queuedPosts['id'].isin(retriedIds)]
+            if not stillDeferredPosts.empty:
+                queuedPosts = pd.concat([queuedPosts, stillDeferredPosts], ignore_index=True)
+            DataCollectionWorker._writeDeferredPosts(epochName, queuedPosts)
+
+        return len(queuedPosts)
+
+
+    def drainDeferredPosts(self, timeout: dt.timedelta) -> int:
+        '''
+        Retry the deferred posts until all of them are done or the timeout passes.
+
+        Return the number of posts which are still deferred.
+        '''
+        deadline = dt.datetime.now() + timeout
+
+        while True:
+            numOfDeferredPosts = self.retryDeferredPosts()
+            if 0 == numOfDeferredPosts or dt.datetime.now() >= deadline:
+                return numOfDeferredPosts
+
+            time.sleep(ImageFetcher.resetTimeout.total_seconds())  # wait for the circuits to let a trial through
+
+
+    def _queueDeferredPosts(self, epoch):
+        '''
+        Move the posts deferred by the interface into the deferred queue of the epoch.
+        '''
+        deferredPosts = self._interface.takeDeferredPosts()
+        if deferredPosts.empty:
+            return
+
+        epochName = DataCollectionWorker._getEpochName(epoch)
+
+        with DataCollectionWorker._lock:
+            queuedPosts = DataCollectionWorker._readDeferredPosts(epochName)
+            if not queuedPosts.empty:
+                deferredPosts = pd.concat([queuedPosts, deferredPosts], ignore_index=True) \
+                                  .drop_duplicates('id', keep='last')
+            DataCollectionWorker._writeDeferredPosts(epochName, deferredPosts)
+
+
+    def _processChunk(self, postAttributes: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Process a chunk of downloaded posts before it is checkpointed.
+        '''
+        if postAttributes.empty:
+            return postAttributes
+
+        # ONLINE PROCESSING
+        # return self._process(postAttributes)
+
+        return postAttributes
+
+
     # ONLINE PROCESSING
     '''
     def _process(self, postAttributes: pd.DataFrame):
-        postAttributes['imageobjects'] = self._imageClassifier.classify(postAttributes['image'])
+        if self._thumbnailFirst:
+            return self._thumbnailProcessor.process(postAttributes)
+
+        postAttributes['imageobjects'], embeddings = self._imageClassifier.classifyAndEmbed(postAttributes['image'])
+        self._embeddingStore.append(postAttributes['id'].tolist(), embeddings)
         postAttributes['words']        = self._ocr.extractText(postAttributes['image'])
         imageColours                   = self._colours.extractColours(postAttributes['image'])
         postAttributes = pd.concat([postAttributes, imageColours], axis=1)
@@ -128,12 +305,205 @@ class DataCollectionWorker(Thread):
     def _save(cls, epoch, attributes):
         '''
         Print collected data into the file belonging to the epoch.
+
+        The file is written atomically, an existing output file is always complete.
+        '''
+        outputFileName = f"{cls._outputDirectory}/{cls._getEpochName(epoch)}.csv"
+
+        cls._writeAtomically(attributes, outputFileName)
+
+
+    @classmethod
+    def _saveRecoveredPosts(cls, epochName: str, attributes: pd.DataFrame):
         '''
-        outputFileName = f"{cls._outputDirectory}/" \
-            + f"{epoch['start'].strftime('%Y%m%d%H%M%S')}" \
-            + f"_{epoch['end'].strftime('%Y%m%d%H%M%S')}.csv"
+        Add recovered deferred posts to the deferred output file of the epoch. Call with the lock held.
+        '''
+        recoveredDirectory = f"{cls._outputDirectory}/deferred"
+        if not os.path.exists(recoveredDirectory):
+            os.makedirs(recoveredDirectory)
+
+        outputFileName = f"{recoveredDirectory}/{epochName}.csv"
+        if os.path.exists(outputFileName):
+            attributes = pd.concat([cls._readCsv(outputFileName), attributes], ignore_index=True) \
+                           .drop_duplicates('id', keep='last')
+
+        cls._writeAtomically(attributes, outputFileName)
+
+
+    @classmethod
+    def _getDeferredEpochNames(cls) -> list:
+        '''
+        Return the names of the epochs having deferred posts. Call with the lock held.
+
+        The deferred posts of each epoch are kept in a file, so they survive a crash or restart.
+        '''
+        deferredDirectory = f"{cls._outputDirectory}/.deferred"
+        if not os.path.exists(deferredDirectory):
+            return []
+
+        return [os.path.splitext(fileName)[0] for fileName in sorted(os.listdir(deferredDirectory))
+                if fileName.endswith('.csv')]
+
+
+    @classmethod
+    def _readDeferredPosts(cls, epochName: str) -> pd.DataFrame:
+        '''
+        Return the deferred posts of the epoch. Call with the lock held.
+        '''
+        deferredFileName = f"{cls._outputDirectory}/.deferred/{epochName}.csv"
+        if not os.path.exists(deferredFileName):
+            return pd.DataFrame()
+
+        return cls._readCsv(deferredFileName)
+
+
+    @classmethod
+    def _writeDeferredPosts(cls, epochName: str, attributes: pd.DataFrame):
+        '''
+        Replace the deferred posts of the epoch. Call with the lock held.
+        '''
+        deferredDirectory = f"{cls._outputDirectory}/.deferred"
+        deferredFileName = f"{deferredDirectory}/{epochName}.csv"
+
+        if attributes.empty:
+            if os.path.exists(deferredFileName):
+                os.remove(deferredFileName)
+        else:
+            if not os.path.exists(deferredDirectory):
+                os.makedirs(deferredDirectory)
+            cls._writeAtomically(attributes, deferredFileName)
+
+
+    @classmethod
+    def _checkpoint(cls, epoch, label: str, attributes: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Write a processed chunk of the epoch into the checkpoint directory of the epoch.
+
+        Label tells what the chunk contains: the name of the subreddit or 'batch'.
+        Chunks are numbered in the order they are written.
+        '''
+        checkpointDirectory = cls._getCheckpointDirectory(epoch)
+        if not os.path.exists(checkpointDirectory):
+            os.makedirs(checkpointDirectory)
+
+        index = len([fileName for fileName in os.listdir(checkpointDirectory) if fileName.endswith('.csv')])
+        cls._writeAtomically(attributes, f"{checkpointDirectory}/{index:04d}_{label}.csv")
+
+        return attributes
+
+
+    @classmethod
+    def _loadCheckpoints(cls, epoch) -> list:
+        '''
+        Return the checkpointed chunks of the epoch as a list of (label, attributes) tuples.
+        '''
+        checkpointDirectory = cls._getCheckpointDirectory(epoch)
+        if not os.path.exists(checkpointDirectory):
+            return []
+
+        checkpoints = []
+
+        for fileName in sorted(os.listdir(checkpointDirectory)):
+            if not fileName.endswith('.csv'):
+                continue  # temporary file of an interrupted write
+
+            label = os.path.splitext(fileName)[0].split('_', 1)[1]
+            filePath = f"{checkpointDirectory}/{fileName}"
+
+            checkpoints.append((label, cls._readCsv(filePath)))
+
+        return checkpoints
+
+
+    @classmethod
+    def discardCheckpoints(cls):
+        '''
+        Remove the checkpoints and deferred posts of all epochs, so interrupted epochs are started from scratch.
+        '''
+        for directory in [f"{cls._outputDirectory}/.checkpoints", f"{cls._outputDirectory}/.deferred"]:
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+
+    @classmethod
+    def _removeCheckpoints(cls, epoch):
+        checkpointDirectory = cls._getCheckpointDirectory(epoch)
+        if os.path.exists(checkpointDirectory):
+            shutil.rmtree(checkpointDirectory)
+
+
+    @classmethod
+    def _getCheckpointDirectory(cls, epoch) -> str:
+        return f"{cls._outputDirectory}/.checkpoints/{cls._getEpochName(epoch)}"
+
+
+    @staticmethod
+    def _getEpochName(epoch) -> str:
+        return f"{epoch['start'].strftime('%Y%m%d%H%M%S')}_{epoch['end'].strftime('%Y%m%d%H%M%S')}"
+
+
+    @staticmethod
+    def _readCsv(fileName: str) -> pd.DataFrame:
+        '''
+        Read a file written by _writeAtomically, keep ids as strings even if they only contain digits.
+        '''
+        if 0 == os.path.getsize(fileName):
+            return pd.DataFrame()
+
+        return pd.read_csv(fileName, index_col=0, dtype={'id': str})
+
+
+    @staticmethod
+    def _writeAtomically(attributes: pd.DataFrame, fileName: str):
+        '''
+        Write the attributes into a temporary file and rename it, so the file is never partially written.
+
+        The temporary file is flushed to disk before the rename, otherwise the renamed file
+        could be empty or truncated after a power loss. Empty attributes are written as an empty file.
+        '''
+        temporaryFileName = f"{fileName}.tmp"
+
+        with open(temporaryFileName, 'w', newline='') as temporaryFile:
+            if not attributes.empty:
+                attributes.to_csv(temporaryFile, float_format='%.4f')
+            temporaryFile.flush()
+            os.fsync(temporaryFile.fileno())
+
+        os.replace(temporaryFileName, fileName)
+        DataCollectionWorker._syncDirectory(os.path.dirname(fileName))
+
+
+    @staticmethod
+    def _syncDirectory(directory: str):
+        '''
+        Flush a rename in the directory to disk. Not supported on Windows, where it is skipped.
+        '''
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+
+        directoryDescriptor = os.open(directory or '.', os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directoryDescriptor)
+        finally:
+            os.close(directoryDescriptor)
+
+
+    @classmethod
+    def getClassifierStatistics(cls) -> pd.DataFrame:
+        '''
+        Return the statistics of the cascade classifiers of all workers, summed for each tier.
+        '''
+        statistics = [classifier.getStatistics() for classifier in cls._imageClassifiers
+                      if hasattr(classifier, 'getStatistics')]
+        if not statistics:
+            return pd.DataFrame()
+
+        statistics = pd.concat(statistics).groupby('version', sort=False)[['images', 'escalated', 'seconds']] \
+                       .sum().reset_index()
+        statistics['escalationRate'] = statistics['escalated'] / statistics['images'].where(statistics['images'] > 0)
+        statistics['imagesPerSecond'] = statistics['images'] / statistics['seconds'].where(statistics['seconds'] > 0)
 
-        attributes.to_csv(outputFileName, float_format='%.4f')
+        return statistics
 
 
     @classmethod
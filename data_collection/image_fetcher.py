@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import datetime as dt
+import io
+import random
+import time
+from threading import Lock
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+from PIL import Image
+
+
+class HostUnavailableError(Exception):
+    '''
+    Raised when the circuit breaker of a host is open or the host kept failing until the retries ran out.
+    '''
+    def __init__(self, host: str):
+        super().__init__(f"Host {host} is temporarily unavailable.")
+        self.host = host
+
+
+class ImageFetcher:
+    '''
+    Download images with per-host timeouts, retries and circuit breakers.
+
+    Host state is shared between all worker threads, so one failing host is detected
+    once and skipped by every worker until it recovers.
+    '''
+    _lock = Lock()      # static lock object to access host states
+    _hostStates = {}    # static dictionary: host -> state of its circuit breaker and counters
+
+    defaultTimeout = (3.05, 10)                          # (connect, read) timeout in seconds
+    hostTimeouts = {'i.redd.it':   (3.05, 10),
+                    'i.imgur.com': (3.05, 15),
+                    'imgur.com':   (3.05, 15)}
+    maxRetries = 3                                       # number of retries after the first attempt
+    backoffFactor = 0.5                                  # first backoff in seconds, doubled for every retry
+    maxBackoff = 8.                                      # upper limit of a single backoff in seconds
+    failureThreshold = 5                                 # consecutive failures opening the circuit of a host
+    resetTimeout = dt.timedelta(seconds=60)              # time after which an open circuit lets a trial request through
+    retryableStatusCodes = {429, 500, 502, 503, 504}     # responses worth retrying, counted as host failures
+
+
+    def fetch(self, url: str):
+        '''
+        Download and open the image at the url.
+
+        Return None if the image is definitely not available (e.g. 404 or not an image).
+        Raise HostUnavailableError if the circuit of the host is open or all retries failed
+        on timeouts, connection errors or 429/5xx responses, so the post can be retried later.
+        '''
+        host = urlparse(url).netloc.lower()
+
+        if not ImageFetcher._allowRequest(host):
+            raise HostUnavailableError(host)
+
+        timeout = ImageFetcher.hostTimeouts.get(host, ImageFetcher.defaultTimeout)
+
+        for attempt in range(ImageFetcher.maxRetries + 1):
+            if 0 != attempt:
+                time.sleep(ImageFetcher._getBackoff(attempt))
+
+                if not ImageFetcher._allowRequest(host):
+                    raise HostUnavailableError(host)
+
+            try:
+                response = requests.get(url, timeout=timeout)
+
+                if response.status_code in ImageFetcher.retryableStatusCodes:
+                    ImageFetcher._recordFailure(host)
+                    continue
+
+                ImageFetcher._recordSuccess(host)  # host answered, even if the image itself is missing
+            except (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                    requests.exceptions.InvalidSchema, requests.exceptions.TooManyRedirects):
+                return None  # retrying would not help, and the host did not fail
+            except requests.exceptions.RequestException:
+                ImageFetcher._recordFailure(host)
+                continue
+            finally:
+                ImageFetcher._releaseTrial(host)  # on every exit path, or the circuit would never close again
+
+            if 200 != response.status_code:
+                return None
+
+            try:
+                return Image.open(io.BytesIO(response.content))  # try to read image
+            except IOError:
+                return None
+
+        raise HostUnavailableError(host)  # retries ran out, the image may still be there
+
+
+    @classmethod
+    def isAvailable(cls, url: str) -> bool:
+        '''
+        Check whether a request to the host of the url would be attempted now.
+        '''
+        host = urlparse(url).netloc.lower()
+
+        with cls._lock:
+            state = cls._hostStates.get(host)
+            return state is None or state['openedAt'] is None \
+                or dt.datetime.now() - state['openedAt'] >= cls.resetTimeout
+
+
+    @classmethod
+    def getHostStatistics(cls) -> pd.DataFrame:
+        '''
+        Return request and failure counts for each host.
+        '''
+        with cls._lock:
+            statistics = [{'host':                host,
+                           'requests':            state['requests'],
+                           'failures':            state['failures'],
+                           'consecutiveFailures': state['consecutiveFailures'],
+                           'rejected':            state['rejected'],
+                           'circuitOpen':         state['openedAt'] is not None}
+                          for host, state in cls._hostStates.items()]
+
+        return pd.DataFrame(statistics)
+
+
+    @classmethod
+    def _getState(cls, host: str) -> dict:
+        '''
+        Return the state of the host, create it if it does not exist. Call with the lock held.
+        '''
+        if host not in cls._hostStates:
+            cls._hostStates[host] = {'requests':            0,     # number of attempted requests
+                                     'failures':            0,     # number of failed requests in total
+                                     'consecutiveFailures': 0,     # number of failed requests since the last success
+                                     'rejected':            0,     # number of requests refused by the open circuit
+                                     'openedAt':            None,  # time when the circuit was opened, None if closed
+                                     'trialInProgress':     False} # a request is probing a half-open circuit
+        return cls._hostStates[host]
+
+
+    @classmethod
+    def _allowRequest(cls, host: str) -> bool:
+        '''
+        Decide whether a request may be sent to the host and count it.
+
+        After the reset timeout of an open circuit, a single trial request is let through.
+        '''
+        with cls._lock:
+            state = cls._getState(host)
+
+            if state['openedAt'] is not None:
+                halfOpen = dt.datetime.now() - state['openedAt'] >= cls.resetTimeout
+                if not halfOpen or state['trialInProgress']:
+                    state['rejected'] += 1
+                    return False
+                state['trialInProgress'] = True
+
+            state['requests'] += 1
+            return True
+
+
+    @classmethod
+    def _releaseTrial(cls, host: str):
+        '''
+        Let the next trial request through a half-open circuit, whatever the outcome of this one was.
+        '''
+        with cls._lock:
+            cls._getState(host)['trialInProgress'] = False
+
+
+    @classmethod
+    def _recordSuccess(cls, host: str):
+        with cls._lock:
+            state = cls._getState(host)
+            state['consecutiveFailures'] = 0
+            state['openedAt'] = None
+            state['trialInProgress'] = False
+
+
+    @classmethod
+    def _recordFailure(cls, host: str):
+        with cls._lock:
+            state = cls._getState(host)
+            state['failures'] += 1
+            state['consecutiveFailures'] += 1
+
+            if state['trialInProgress'] or state['consecutiveFailures'] >= cls.failureThreshold:
+                state['openedAt'] = dt.datetime.now()  # (re)open the circuit
+            state['trialInProgress'] = False
+
+
+    @classmethod
+    def _getBackoff(cls, attempt: int) -> float:
+        '''
+        Exponential backoff with jitter before the given retry attempt.
+        '''
+        backoff = min(cls.maxBackoff, cls.backoffFactor * 2 ** (attempt - 1))
+        return backoff * random.uniform(0.5, 1.)
@@ -14,6 +14,8 @@ from queue import Queue
 
 from data_collection_config import DataCollectionConfig
 from data_collection_worker import DataCollectionWorker
+from tail_collection_worker import TailCollectionWorker
+from image_fetcher import ImageFetcher
 
 import cProfile, pstats, io
 
@@ -26,6 +28,7 @@ def main():
     numOfThreads = 8
     downloadData = True
     mergeData    = False
+    tailData     = False  # collect new posts continuously, until interrupted
 
     outputDirectory = 'output'
     continueDownload = True  # do not download already downloaded data again
@@ -40,6 +43,16 @@ def main():
     numOfPostsPerDay = 50  # maximum number of posts to download for each day
     frequency = 1            # number of days to skip between two days to collect (in days)
 
+    batchedQuery = False               # query all subreddits together in each epoch
+    quotaDistribution = 'sequential'   # 'sequential': fill quota subreddit by subreddit, 'even': subreddits take turns
+    thumbnailFirst = False             # process thumbnails, download full images only for OCR
+    deferredRetryTimeout = 10          # minutes to retry posts of unavailable image hosts after the last epoch
+
+    # tail mode
+    tailPollInterval  = 60   # seconds between two polls of the subreddits
+    tailFlushInterval = 300  # maximum number of seconds new posts are kept in memory
+    tailFlushSize     = 100  # number of new posts written into one file at most
+
     subReddits = ['memes',
                   'dankmemes',
                   'memeeconomy',
@@ -69,6 +82,13 @@ def main():
     dataCollectionConfig.continueDownload = continueDownload
     dataCollectionConfig.subReddits = subReddits
     dataCollectionConfig.outputDirectory = outputDirectory
+    dataCollectionConfig.batchedQuery = batchedQuery
+    dataCollectionConfig.quotaDistribution = quotaDistribution
+    dataCollectionConfig.thumbnailFirst = thumbnailFirst
+    dataCollectionConfig.deferredRetryTimeout = deferredRetryTimeout
+    dataCollectionConfig.tailPollInterval = tailPollInterval
+    dataCollectionConfig.tailFlushInterval = tailFlushInterval
+    dataCollectionConfig.tailFlushSize = tailFlushSize
 
     if profile:
         assert(1 == numOfThreads)
@@ -78,6 +98,9 @@ def main():
     if downloadData:
         downloadAndProcessPosts(numOfThreads, dataCollectionConfig)
     
+    if tailData:
+        tailPosts(dataCollectionConfig)
+
     if mergeData:
         mergedData = loadData('output')
         mergedData.to_csv('merged_data.csv', float_format='%.4f')
@@ -99,8 +122,19 @@ def downloadAndProcessPosts(numOfThreads: int, dataCollectionConfig):
         epochs = dataCollectionConfig.removeDownloadedEpochs(epochs, dataCollectionConfig.outputDirectory)
         DataCollectionWorker._processedEpochsInTotal = DataCollectionWorker._numOfEpochs - len(epochs)
 
+    # initialization
+    DataCollectionWorker.initialize(dataCollectionConfig.subReddits,
+                                    dataCollectionConfig.outputDirectory,
+                                    dataCollectionConfig.batchedQuery,
+                                    dataCollectionConfig.quotaDistribution,
+                                    dataCollectionConfig.thumbnailFirst)
+
+    if not dataCollectionConfig.continueDownload:
+        DataCollectionWorker.discardCheckpoints()
+
     if epochs.empty:
         print(f"Nothing to download.", flush=True)
+        drainDeferredPosts(dataCollectionConfig.deferredRetryTimeout)  # left over from an earlier run
         return
 
     print(f"{dt.datetime.now().strftime('%m/%d %H:%M:%S')}: Scraper is processing " +
@@ -108,17 +142,60 @@ def downloadAndProcessPosts(numOfThreads: int, dataCollectionConfig):
           f"with {numOfThreads} threads.",
           flush=True)
 
-    # initialization
-    DataCollectionWorker.initialize(dataCollectionConfig.subReddits,
-                                    dataCollectionConfig.outputDirectory)
-
     if numOfThreads != 1:
         startThreads(numOfThreads, epochs)
     else:
         startSingleThread(epochs)
 
+    drainDeferredPosts(dataCollectionConfig.deferredRetryTimeout)
+
     print(f"\n{dt.datetime.now().strftime('%m/%d %H:%M:%S')}: Scraper finished.", flush=True)
 
+    hostStatistics = ImageFetcher.getHostStatistics()
+    if not hostStatistics.empty:
+        print(hostStatistics.to_string(index=False), flush=True)
+
+    classifierStatistics = DataCollectionWorker.getClassifierStatistics()  # empty without online processing
+    if not classifierStatistics.empty:
+        print(classifierStatistics.to_string(index=False), flush=True)
+
+
+def drainDeferredPosts(timeoutInMinutes: int):
+
+    tokenFileName = 'config/token.txt'
+    tokens = pd.read_csv(tokenFileName)
+    worker = DataCollectionWorker(0, tokens.iloc[0])
+
+    numOfDeferredPosts = worker.drainDeferredPosts(dt.timedelta(minutes=timeoutInMinutes))
+
+    if 0 != numOfDeferredPosts:
+        print(f"\n{numOfDeferredPosts} posts could not be downloaded, their image host is unavailable. "
+              + "They are retried in the next run.", flush=True)
+
+
+def tailPosts(dataCollectionConfig):
+
+    DataCollectionWorker.initialize(dataCollectionConfig.subReddits,
+                                    dataCollectionConfig.outputDirectory,
+                                    thumbnailFirst=dataCollectionConfig.thumbnailFirst)
+
+    TailCollectionWorker.pollInterval = dataCollectionConfig.tailPollInterval
+    TailCollectionWorker.flushInterval = dataCollectionConfig.tailFlushInterval
+    TailCollectionWorker.flushSize = dataCollectionConfig.tailFlushSize
+
+    tokenFileName = 'config/token.txt'
+    tokens = pd.read_csv(tokenFileName)
+    worker = TailCollectionWorker(0, tokens.iloc[0])
+
+    print(f"{dt.datetime.now().strftime('%m/%d %H:%M:%S')}: Scraper is collecting new posts " +
+          f"of {len(dataCollectionConfig.subReddits)} subreddits, stop it with Ctrl-C.",
+          flush=True)
+
+    try:
+        worker.run()  # runs in the main thread until interrupted
+    except KeyboardInterrupt:
+        print(f"{dt.datetime.now().strftime('%m/%d %H:%M:%S')}: Scraper stopped.", flush=True)
+
 
 def startThreads(numOfThreads: int, epochs: pd.DataFrame):
 
@@ -151,8 +228,9 @@ def startSingleThread(epochs: pd.DataFrame):
         postAttributes = worker._collect(epoch)
 
         if not postAttributes.empty:  # some images found
-            processedAttributes = worker._process(postAttributes)
-            DataCollectionWorker._save(epoch, processedAttributes)
+            DataCollectionWorker._save(epoch, postAttributes)
+
+        DataCollectionWorker._removeCheckpoints(epoch)
 
         DataCollectionWorker._processedEpochsInThisRun += 1
         DataCollectionWorker._processedEpochsInTotal += 1
@@ -162,7 +240,8 @@ def startSingleThread(epochs: pd.DataFrame):
 
 def loadData(filesDirectory: str):
 
-    allFiles = glob.glob(os.path.join(filesDirectory, "*.csv"))
+    allFiles = glob.glob(os.path.join(filesDirectory, "*.csv")) \
+             + glob.glob(os.path.join(filesDirectory, "deferred", "*.csv"))  # recovered deferred posts
     mergedData = pd.concat((pd.read_csv(f, index_col=0) for f in allFiles))
     mergedData.reset_index(drop=True, inplace=True)
     mergedData['imageobjects'] = mergedData['imageobjects'].apply(eval)
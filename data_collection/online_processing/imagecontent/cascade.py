@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from .efficientnet import EfficientNetClassifier
+from .imageclassifier import ImageClassifier
+
+
+class CascadeClassifier(ImageClassifier):
+    '''
+    Classify images with increasingly large EfficientNet models.
+
+    Every image is classified by the smallest model first. Images whose top-1 probability is
+    below the confidence threshold are sent to the next, larger model, so the expensive models
+    only see the images the cheap ones are unsure about.
+    '''
+    def __init__(self, versions: tuple = (0, 5), confidenceThreshold: float = 0.5):
+        self._versions = list(versions)
+        self._tiers = [EfficientNetClassifier(version) for version in self._versions]
+        self.confidenceThreshold = confidenceThreshold
+
+        self._statistics = [{'images': 0, 'escalated': 0, 'seconds': 0.} for _ in self._tiers]
+
+    def classify(self, images: pd.Series) -> pd.Series:
+        '''
+        Take image and return object list recognized with probability higher than a threshold.
+        '''
+        return self.classifyAndEmbed(images)[0]
+
+    def classifyAndEmbed(self, images: pd.Series):
+        '''
+        Return the recognized object lists and the embeddings of the images.
+
+        The embeddings come from the first tier, which sees every image, so they have the same dimension.
+        '''
+        images = list(images)
+        probabilities = [None] * len(images)
+        embeddings = None
+        pendingIndices = list(range(len(images)))  # images to classify by the current tier
+
+        for tierIndex, tier in enumerate(self._tiers):
+            if not pendingIndices:
+                break
+
+            startTime = time.perf_counter()
+            if 0 == tierIndex:
+                y, embeddings = tier.predictWithEmbeddings(images)
+            else:
+                y = tier.predict([images[index] for index in pendingIndices])
+            elapsedSeconds = time.perf_counter() - startTime
+
+            for index, imageProbabilities in zip(pendingIndices, y):
+                probabilities[index] = imageProbabilities
+
+            if tierIndex == len(self._tiers) - 1:
+                escalatedIndices = []  # last tier, its predictions are final
+            else:
+                confidences = y.max(axis=1)  # top-1 probability of each image
+                escalatedIndices = [index for index, confidence in zip(pendingIndices, confidences)
+                                    if confidence < self.confidenceThreshold]
+
+            statistics = self._statistics[tierIndex]
+            statistics['images'] += len(pendingIndices)
+            statistics['escalated'] += len(escalatedIndices)
+            statistics['seconds'] += elapsedSeconds
+
+            pendingIndices = escalatedIndices
+
+        if not images:
+            return pd.Series([], dtype=object), np.empty((0, 0), dtype=np.float32)
+
+        return EfficientNetClassifier.decode(np.array(probabilities)), embeddings
+
+    def getStatistics(self) -> pd.DataFrame:
+        '''
+        Return the number of classified images, escalation rate and throughput of each tier.
+        '''
+        statistics = pd.DataFrame(self._statistics)
+        statistics.insert(0, 'version', self._versions)
+        statistics['escalationRate'] = statistics['escalated'] / statistics['images'].where(statistics['images'] > 0)
+        statistics['imagesPerSecond'] = statistics['images'] / statistics['seconds'].where(statistics['seconds'] > 0)
+
+        return statistics
\ No newline at end of file
@@ -5,6 +5,7 @@ import pandas as pd
 
 import efficientnet.keras as en
 from keras.applications.imagenet_utils import decode_predictions
+from keras.models import Model
 from skimage.io import imread
 
 from PIL import Image
@@ -33,12 +34,43 @@ class EfficientNetClassifier(ImageClassifier):
 
         self._imageSize = self._prediction.input_shape[1]
 
+        # same network, also returning the output of the global pooling layer as the embedding of the image
+        self._embeddingModel = Model(inputs=self._prediction.input,
+                                     outputs=[self._prediction.output, self._prediction.get_layer('avg_pool').output])
+
     def classify(self, images: pd.Series) -> pd.Series:
         '''
         Take image and return object list recognized with probability higher than a threshold.
         '''
+        return self.decode(self.predict(images))
+
+    def classifyAndEmbed(self, images: pd.Series):
+        '''
+        Return the recognized object lists and the embeddings of the images, one row for each image.
+        '''
+        y, embeddings = self.predictWithEmbeddings(images)
+        return self.decode(y), embeddings
+
+    def predict(self, images) -> np.ndarray:
+        '''
+        Return the class probabilities of the images, one row for each image.
+        '''
         preprocessedImages = self._preprocessInput(images)
-        y = self._prediction.predict(preprocessedImages)
+        return self._prediction.predict(preprocessedImages)
+
+    def predictWithEmbeddings(self, images):
+        '''
+        Return the class probabilities and the penultimate layer features of the images in one pass.
+        '''
+        preprocessedImages = self._preprocessInput(images)
+        y, embeddings = self._embeddingModel.predict(preprocessedImages)
+        return y, embeddings
+
+    @staticmethod
+    def decode(y: np.ndarray) -> pd.Series:
+        '''
+        Return object list recognized with probability higher than a threshold for each row of probabilities.
+        '''
         predictions = decode_predictions(y)  # list of predictions for each image
 
         predictedObjects = []
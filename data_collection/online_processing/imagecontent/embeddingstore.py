@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from threading import Lock
+
+import numpy as np
+
+
+class EmbeddingStore:
+    '''
+    Append-only store of image embeddings in a memory-mapped float16 matrix.
+
+    The directory of the store contains:
+        embeddings.f16: the rows of the matrix, raw float16 values
+        ids.txt:        id of the post belonging to each row, one per line
+        meta.json:      dimension of the embeddings
+
+    Rows are written before their ids, so rows without an id (interrupted append) are cut off on opening,
+    together with a last id which was not completely written.
+    '''
+    _dataFileName = 'embeddings.f16'
+    _idsFileName = 'ids.txt'
+    _metaFileName = 'meta.json'
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        self._lock = Lock()
+        self._dimension = None
+        self._ids = []         # id of each row
+        self._rowOfId = {}     # id -> row
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        metaFileName = os.path.join(directory, EmbeddingStore._metaFileName)
+        if os.path.exists(metaFileName):
+            with open(metaFileName) as metaFile:
+                self._dimension = json.load(metaFile)['dimension']
+
+        idsFileName = os.path.join(directory, EmbeddingStore._idsFileName)
+        if os.path.exists(idsFileName):
+            with open(idsFileName) as idsFile:
+                idsText = idsFile.read()
+
+            if not idsText.endswith('\n'):
+                # last id was partially written, drop it with its row
+                idsText = idsText[:idsText.rfind('\n') + 1]
+                with open(idsFileName, 'w') as idsFile:
+                    idsFile.write(idsText)
+
+            self._ids = idsText.splitlines()
+            self._rowOfId = {postId: row for row, postId in enumerate(self._ids)}
+
+        dataFileName = os.path.join(directory, EmbeddingStore._dataFileName)
+        if os.path.exists(dataFileName) and self._dimension is not None:
+            with open(dataFileName, 'r+b') as dataFile:
+                dataFile.truncate(len(self._ids) * self._getRowSize())
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+    def append(self, ids, embeddings: np.ndarray):
+        '''
+        Append the embeddings of the posts, rows of already stored ids are skipped.
+        '''
+        if 0 == len(ids):
+            return
+
+        embeddings = np.asarray(embeddings, dtype=np.float16).reshape(len(ids), -1)
+
+        with self._lock:
+            if self._dimension is None:
+                self._writeMeta(embeddings.shape[1])
+            assert(embeddings.shape[1] == self._dimension)
+
+            newRows = [row for row, postId in enumerate(ids) if str(postId) not in self._rowOfId]
+            newIds = [str(ids[row]) for row in newRows]
+
+            if not newRows:
+                return
+
+            with open(os.path.join(self._directory, EmbeddingStore._dataFileName), 'ab') as dataFile:
+                dataFile.write(embeddings[newRows].tobytes())
+                dataFile.flush()
+                os.fsync(dataFile.fileno())
+
+            with open(os.path.join(self._directory, EmbeddingStore._idsFileName), 'a') as idsFile:
+                idsFile.write(''.join(f"{postId}\n" for postId in newIds))
+                idsFile.flush()
+                os.fsync(idsFile.fileno())
+
+            for postId in newIds:
+                self._rowOfId[postId] = len(self._ids)
+                self._ids.append(postId)
+
+    def getMatrix(self) -> np.ndarray:
+        '''
+        Return the stored embeddings as a read-only memory-mapped matrix, one row for each id.
+        '''
+        with self._lock:
+            numOfRows = len(self._ids)
+
+        if 0 == numOfRows:
+            return np.empty((0, self._dimension or 0), dtype=np.float16)
+
+        return np.memmap(os.path.join(self._directory, EmbeddingStore._dataFileName),
+                         dtype=np.float16, mode='r', shape=(numOfRows, self._dimension))
+
+    def getRow(self, postId):
+        '''
+        Return the row of the post, None if it is not stored.
+        '''
+        return self._rowOfId.get(str(postId))
+
+    def getId(self, row: int) -> str:
+        return self._ids[row]
+
+    def getEmbedding(self, postId) -> np.ndarray:
+        return np.array(self.getMatrix()[self._rowOfId[str(postId)]], dtype=np.float32)
+
+    def _getRowSize(self) -> int:
+        return self._dimension * np.dtype(np.float16).itemsize
+
+    def _writeMeta(self, dimension: int):
+        '''
+        Write the meta file into a temporary file and rename it, so it is never partially written.
+        '''
+        metaFileName = os.path.join(self._directory, EmbeddingStore._metaFileName)
+        temporaryFileName = f"{metaFileName}.tmp"
+
+        with open(temporaryFileName, 'w') as temporaryFile:
+            json.dump({'dimension': dimension}, temporaryFile)
+            temporaryFile.flush()
+            os.fsync(temporaryFile.fileno())
+
+        os.replace(temporaryFileName, metaFileName)
+        EmbeddingStore._syncDirectory(self._directory)
+
+        self._dimension = dimension
+
+    @staticmethod
+    def _syncDirectory(directory: str):
+        '''
+        Flush a rename in the directory to disk. Not supported on Windows, where it is skipped.
+        '''
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+
+        directoryDescriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directoryDescriptor)
+        finally:
+            os.close(directoryDescriptor)
\ No newline at end of file
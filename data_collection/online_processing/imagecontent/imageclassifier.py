@@ -3,4 +3,7 @@
 
 class ImageClassifier:
     def classify(self, image) -> list:
+        raise NotImplementedError
+
+    def classifyAndEmbed(self, image):
         raise NotImplementedError
\ No newline at end of file
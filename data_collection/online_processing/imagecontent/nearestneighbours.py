@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .embeddingstore import EmbeddingStore
+
+
+class IVFIndex:
+    '''
+    Approximate nearest neighbour search over an embedding store by cosine similarity.
+
+    Inverted file index: the embeddings are assigned to the closest of numOfLists k-means centroids,
+    a query only scans the lists of its numOfProbes closest centroids. The embeddings themselves stay
+    in the memory-mapped matrix of the store, only the rows of the probed lists are read.
+    '''
+    _centroidsFileName = 'ivf_centroids.npy'
+    _assignmentsFileName = 'ivf_assignments.npy'
+    _chunkSize = 16384  # number of rows processed at once when assigning rows to lists
+
+    def __init__(self, store: EmbeddingStore, numOfLists: int = 1024, numOfProbes: int = 8):
+        self._store = store
+        self.numOfLists = numOfLists
+        self.numOfProbes = numOfProbes
+
+        self._centroids = None                              # unit length centroid of each list
+        self._assignments = np.empty(0, dtype=np.int32)     # list of each indexed row
+        self._lists = []                                    # rows belonging to each list
+
+    def train(self, sampleSize: int = 100000, numOfIterations: int = 10, seed: int = 0):
+        '''
+        Compute the centroids by spherical k-means on a sample of the stored embeddings and index all rows.
+        '''
+        matrix = self._store.getMatrix()
+        assert(0 != len(matrix))  # nothing to train on
+
+        generator = np.random.default_rng(seed)
+
+        sampleRows = np.sort(generator.choice(len(matrix), size=min(sampleSize, len(matrix)), replace=False))
+        sample = IVFIndex._normalize(matrix[sampleRows])
+
+        numOfLists = min(self.numOfLists, len(sample))
+        centroids = sample[generator.choice(len(sample), size=numOfLists, replace=False)]
+
+        for _ in range(numOfIterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+
+            for listIndex in range(numOfLists):
+                members = sample[assignments == listIndex]
+                if 0 != len(members):  # empty lists keep their old centroid
+                    centroids[listIndex] = members.sum(axis=0)
+
+            centroids = IVFIndex._normalize(centroids)
+
+        self._centroids = centroids
+        self._assignments = np.empty(0, dtype=np.int32)
+        self.update()
+
+    def update(self):
+        '''
+        Assign the rows appended to the store since the last update to their lists.
+        '''
+        matrix = self._store.getMatrix()
+        newAssignments = [self._assign(matrix[start:start + IVFIndex._chunkSize])
+                          for start in range(len(self._assignments), len(matrix), IVFIndex._chunkSize)]
+
+        if newAssignments:
+            self._assignments = np.concatenate([self._assignments] + newAssignments)
+            self._buildLists()
+
+    def search(self, embedding: np.ndarray, k: int = 10) -> pd.DataFrame:
+        '''
+        Return the ids of the k most similar stored embeddings and their cosine similarity.
+        '''
+        rows, similarities = self._searchRows(embedding)
+        best = np.argsort(-similarities)[:k]
+
+        return pd.DataFrame({'id':         [self._store.getId(row) for row in rows[best]],
+                             'similarity': similarities[best]})
+
+    def findSimilar(self, postId, k: int = 10) -> pd.DataFrame:
+        '''
+        Return the k memes most similar to the stored meme, not including itself.
+        '''
+        similar = self.search(self._store.getEmbedding(postId), k + 1)
+        return similar[similar['id'] != str(postId)].head(k).reset_index(drop=True)
+
+    def findTemplateCluster(self, postId, minSimilarity: float = 0.9) -> pd.DataFrame:
+        '''
+        Return the memes which are at least minSimilarity similar to the stored meme,
+        i.e. which are probably made from the same template.
+        '''
+        rows, similarities = self._searchRows(self._store.getEmbedding(postId))
+        inCluster = similarities >= minSimilarity
+        order = np.argsort(-similarities[inCluster])
+
+        return pd.DataFrame({'id':         [self._store.getId(row) for row in rows[inCluster][order]],
+                             'similarity': similarities[inCluster][order]})
+
+    def save(self, directory: str):
+        np.save(os.path.join(directory, IVFIndex._centroidsFileName), self._centroids)
+        np.save(os.path.join(directory, IVFIndex._assignmentsFileName), self._assignments)
+
+    def load(self, directory: str):
+        '''
+        Load a saved index and index the rows appended since it was saved.
+        '''
+        self._centroids = np.load(os.path.join(directory, IVFIndex._centroidsFileName))
+        self._assignments = np.load(os.path.join(directory, IVFIndex._assignmentsFileName))
+        self._buildLists()
+        self.update()
+
+    def _searchRows(self, embedding: np.ndarray):
+        '''
+        Return the rows in the probed lists of the embedding and their cosine similarity to it.
+        '''
+        assert(self._centroids is not None)  # index has to be trained or loaded first
+
+        query = IVFIndex._normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+
+        probedLists = np.argsort(-(self._centroids @ query))[:self.numOfProbes]
+        rows = np.sort(np.concatenate([self._lists[listIndex] for listIndex in probedLists]))
+
+        matrix = self._store.getMatrix()
+        similarities = IVFIndex._normalize(matrix[rows]) @ query
+
+        return rows, similarities
+
+    def _assign(self, embeddings: np.ndarray) -> np.ndarray:
+        return np.argmax(IVFIndex._normalize(embeddings) @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _buildLists(self):
+        order = np.argsort(self._assignments, kind='stable')
+        boundaries = np.searchsorted(self._assignments[order], np.arange(len(self._centroids) + 1))
+        self._lists = [order[boundaries[listIndex]:boundaries[listIndex + 1]] for listIndex in range(len(self._centroids))]
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
\ No newline at end of file
@@ -37,6 +37,60 @@ class OCR:
 
         return pd.Series(wordLists)
 
+    def containsText(self, rawImages, minNumOfLines: int = 1) -> pd.Series:
+        '''
+        Cheap check whether images contain text, meant to be run on thumbnails.
+
+        Does not run Tesseract. Strong edges are merged horizontally into regions,
+        regions which are wide, mostly filled and not too tall count as lines of text.
+
+        @return: series with True for images where at least minNumOfLines lines of text are detected
+        '''
+        textPresence = []
+
+        for rawImage in rawImages:
+            numOfLines = len(self._detectTextLines(rawImage))
+            textPresence.append(numOfLines >= minNumOfLines)
+
+        return pd.Series(textPresence)
+
+    def _detectTextLines(self, rawImage, minHeight: int = 4, minAspectRatio: float = 2.0, minFillRatio: float = 0.45) -> list:
+        '''
+        @return: bounding boxes (x, y, width, height) of the regions that look like lines of text
+        '''
+        grayImage = np.array(rawImage.convert('L'), dtype=np.uint8)
+        imageHeight = grayImage.shape[0]
+
+        # strokes of characters give strong local contrast
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        gradient = cv2.morphologyEx(grayImage, cv2.MORPH_GRADIENT, kernel)
+
+        # a flat image has no edges, Otsu would pick a threshold of zero
+        if gradient.max() < 32:
+            return []
+
+        _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+        # merge the characters of a line into one region
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1))
+        connected = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+
+        # the contours are the second to last return value in all OpenCV versions
+        contours = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+        textLines = []
+
+        for contour in contours:
+            x, y, width, height = cv2.boundingRect(contour)
+            fillRatio = cv2.countNonZero(connected[y:y + height, x:x + width]) / (width * height)
+
+            if (minHeight <= height <= imageHeight / 3
+                    and width >= minAspectRatio * height
+                    and fillRatio >= minFillRatio):
+                textLines.append((x, y, width, height))
+
+        return textLines
+
     def _recognizeCharacters(self, processedImage):
         tesseractConfig = r"--oem 3 --psm 11 -c tessedit_char_whitelist= 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.?!,: '"
         recognizedText = pytesseract.image_to_string(processedImage, lang='eng', config=tesseractConfig)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+
+class PerceptualHash:
+    '''
+    Compute perceptual hashes of images.
+
+    Uses the difference hash: the image is shrunk to a small grayscale grid and every
+    bit tells whether a pixel is brighter than its right neighbour. Resized or recompressed
+    copies of an image get the same or nearly the same hash, so it works on thumbnails too.
+    '''
+    hashSize = 8  # the hash has hashSize * hashSize bits
+
+    @classmethod
+    def extractHashes(cls, rawImages) -> pd.Series:
+        '''
+        Calculate the hash of each image.
+
+        @return: series with the hashes as hexadecimal strings
+        '''
+        hashes = []
+
+        for image in rawImages:
+            grayImage = image.convert('L').resize((cls.hashSize + 1, cls.hashSize), Image.LANCZOS)
+            pixels = np.array(grayImage, dtype=np.int16)
+
+            bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+            hashValue = int(''.join('1' if bit else '0' for bit in bits), 2)
+
+            hashes.append(f"{hashValue:0{cls.hashSize * cls.hashSize // 4}x}")
+
+        return pd.Series(hashes)
+
+    @staticmethod
+    def distance(firstHash: str, secondHash: str) -> int:
+        '''
+        Number of differing bits of two hashes, small for similar images.
+        '''
+        return bin(int(firstHash, 16) ^ int(secondHash, 16)).count('1')
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import pandas as pd
+
+from image_fetcher import ImageFetcher, HostUnavailableError
+
+from .perceptualhash import PerceptualHash
+
+
+class ThumbnailFirstProcessor:
+    '''
+    Process posts on their thumbnails, download the full image only when a stage needs it.
+
+    Colours, perceptual hash and image content are computed on the thumbnail. OCR needs the
+    full resolution, so the full image is downloaded only for posts where the thumbnail contains text.
+    If an embedding store is given, the image embeddings of the classifier are appended to it.
+    '''
+    def __init__(self, ocr, colours, imageClassifier, embeddingStore=None):
+        self._ocr = ocr
+        self._colours = colours
+        self._imageClassifier = imageClassifier
+        self._embeddingStore = embeddingStore
+        self._fetcher = ImageFetcher()
+
+    def process(self, postAttributes: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Extract all attributes of the posts and drop the images.
+        '''
+        postAttributes = postAttributes.reset_index(drop=True)
+        images = postAttributes['image']
+
+        if self._embeddingStore is None:
+            postAttributes['imageobjects'] = self._imageClassifier.classify(images)
+        else:
+            postAttributes['imageobjects'], embeddings = self._imageClassifier.classifyAndEmbed(images)
+            self._embeddingStore.append(postAttributes['id'].tolist(), embeddings)
+
+        postAttributes['phash']        = PerceptualHash.extractHashes(images)
+        postAttributes['has_text']     = self._ocr.containsText(images)
+        postAttributes['words']        = self._extractText(postAttributes)
+        imageColours                   = self._colours.extractColours(images)
+        postAttributes = pd.concat([postAttributes, imageColours], axis=1)
+
+        # do not keep image itself, all atributes were extracted
+        postAttributes.drop('image', axis='columns', inplace=True)
+
+        return postAttributes
+
+    def _extractText(self, postAttributes: pd.DataFrame) -> pd.Series:
+        '''
+        Run OCR on the full image of the posts where text was detected.
+        '''
+        wordLists = []
+
+        for _, post in postAttributes.iterrows():
+            fullImage = self._getFullImage(post) if post['has_text'] else None
+
+            if fullImage is None:
+                wordLists.append([])
+            else:
+                wordLists.append(self._ocr.extractText([fullImage])[0])
+
+        return pd.Series(wordLists)
+
+    def _getFullImage(self, post):
+        '''
+        Return the full image of the post, download it if only the thumbnail is available.
+        '''
+        if 'full' == post.get('image_source', 'full'):
+            return post['image']
+
+        try:
+            return self._fetcher.fetch(post['url_to_meme'])
+        except HostUnavailableError:
+            return None
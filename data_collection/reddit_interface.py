@@ -2,21 +2,33 @@
 
 
 import datetime as dt
+from itertools import zip_longest
+from os.path import splitext
+from urllib.parse import urlparse
 import praw
 import pandas as pd
 from psaw import PushshiftAPI
-from PIL import Image
-import requests
-import io
 from threading import Lock
 
+from image_fetcher import ImageFetcher, HostUnavailableError
+
 
 class Reddit:
 
+    _imageExtensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+    _imageHosts = {'i.redd.it', 'i.imgur.com'}  # hosts serving images only
+    _maxPostsPerBatchedQuery = 500  # upper limit of the posts paged through by a batched query, 5 pages of 100
+
+    maxDeferredAttempts = 5                 # downloads tried for a deferred post before it is given up
+    maxDeferredAge = dt.timedelta(days=1)   # time after its first deferral when a post is given up
+
 
-    def __init__(self, token) -> None:
+    def __init__(self, token, thumbnailFirst: bool = False) -> None:
         '''
         Initialize Reddit API by reading client ID and key from token file.
+
+        If thumbnailFirst is set, the thumbnail of the posts is downloaded instead of the full image
+        whenever it is available.
         '''
         self._reddit = praw.Reddit(user_agent=token['api_name'], \
                                    client_id=token['client_id'], \
@@ -25,35 +37,271 @@ class Reddit:
         assert(self._reddit.read_only)
 
         self._api = PushshiftAPI(self._reddit)
+        self._fetcher = ImageFetcher()
+        self._deferredPosts = []  # posts whose image host was unavailable, retried later
+        self._thumbnailFirst = thumbnailFirst
 
 
-    def getPosts(self, subReddit, epoch) -> None:
+    def getPosts(self, subReddit, epoch, oldestFirst: bool = False, seenPosts: dict = None) -> None:
         '''
         Download posts for an epoch.
+
+        By default the newest posts of the epoch are returned, with oldestFirst the oldest ones.
+        If seenPosts (id -> creation time) is given, posts in it are skipped without downloading
+        their image, and every post looked at is added to it.
         '''
         generator = self._api.search_submissions(after=int(epoch['start'].timestamp()),
                                                  before=int(epoch['end'].timestamp()),
                                                  limit=epoch['numOfPosts'],
-                                                 subreddit=subReddit)
+                                                 subreddit=subReddit,
+                                                 sort='asc' if oldestFirst else 'desc')
 
         allPostsAttributes = []
 
         for post in generator:
+            if seenPosts is not None:
+                if post.id in seenPosts:
+                    continue
+                seenPosts[post.id] = post.created_utc
+
             attributes = Reddit._extractAttributes(post)
 
             if post.removed_by_category is None and not post.is_self:
                 # post available and has a link (not text only)
-                try:
-                    response = requests.get(attributes['url_to_meme'])  # try to download image
-                    if 200 == response.status_code:  # request is OK
-                        attributes['image'] = Image.open(io.BytesIO(response.content))  # try to read image
-                        allPostsAttributes.append(attributes)
-                except (IOError, requests.exceptions.RequestException):
-                    pass
+                if self._downloadImage(attributes):
+                    allPostsAttributes.append(attributes)
+
+        return pd.DataFrame(allPostsAttributes)
+
+
+    def getPostChunksFromSubreddits(self, subReddits: list, epoch, quotaDistribution: str = 'sequential',
+                                    downloadedIds: set = frozenset(), chunkSize: int = 25):
+        '''
+        Download posts for an epoch from all subreddits with a single, paged query.
+
+        The quota of the epoch is distributed between the subreddits on the client side:
+            'sequential': subreddits fill the quota one after the other in the given order,
+                          as if they were queried separately
+            'even':       subreddits take turns until the quota is filled
+
+        Posts in downloadedIds were downloaded by an earlier, interrupted run: they count against the
+        quota but are not downloaded again. Yield the downloaded posts in chunks of chunkSize posts.
+        '''
+        candidates = self._getCandidatePosts(subReddits, epoch, quotaDistribution)
+
+        if 'sequential' == quotaDistribution:
+            orderedCandidates = [attributes for postsOfSubReddit in candidates.values() for attributes in postsOfSubReddit]
+        elif 'even' == quotaDistribution:
+            orderedCandidates = [attributes for postsInTurn in zip_longest(*candidates.values())
+                                 for attributes in postsInTurn if attributes is not None]
+        else:
+            assert(False)  # unknown quota distribution
+
+        remainingMemesToDownload = epoch['numOfPosts'] - len(downloadedIds)
+        chunkOfPostsAttributes = []
+
+        for attributes in orderedCandidates:
+            if remainingMemesToDownload <= 0:
+                break
+
+            if attributes['id'] in downloadedIds:
+                continue
+
+            if self._downloadImage(attributes):
+                chunkOfPostsAttributes.append(attributes)
+                remainingMemesToDownload -= 1
+
+            if len(chunkOfPostsAttributes) == chunkSize:
+                yield pd.DataFrame(chunkOfPostsAttributes)
+                chunkOfPostsAttributes = []
+
+        if chunkOfPostsAttributes:
+            yield pd.DataFrame(chunkOfPostsAttributes)
+
+
+    def _getCandidatePosts(self, subReddits: list, epoch, quotaDistribution: str) -> dict:
+        '''
+        Query the posts of all subreddits for an epoch without downloading their images.
+
+        Return the attributes of at most numOfPosts available link posts for each subreddit.
+        Every page is a Pushshift request and a Reddit info call, so paging stops as soon as
+            'sequential': the first subreddit has numOfPosts candidates, it fills the quota alone
+            'even':       every subreddit has numOfPosts candidates
+        and after numOfPosts posts for each subreddit, at most _maxPostsPerBatchedQuery posts in any case.
+        Small subreddits may not have numOfPosts posts in the whole epoch, waiting for them would page
+        through every post of the epoch.
+        '''
+        subReddits = [subReddit.lower() for subReddit in subReddits]
+        limit = min(epoch['numOfPosts'] * len(subReddits), Reddit._maxPostsPerBatchedQuery)
+        generator = self._api.search_submissions(after=int(epoch['start'].timestamp()),
+                                                 before=int(epoch['end'].timestamp()),
+                                                 limit=limit,
+                                                 subreddit=','.join(subReddits))
+
+        candidates = {subReddit: [] for subReddit in subReddits}
+        numOfFullSubReddits = 0
+
+        for post in generator:
+            if post.removed_by_category is not None or post.is_self:
+                continue  # post not available or text only
+
+            attributes = Reddit._extractAttributes(post)
+            subReddit = attributes['subreddit'][len('r/'):].lower()
+
+            if subReddit not in candidates or len(candidates[subReddit]) >= epoch['numOfPosts']:
+                continue
+
+            candidates[subReddit].append(attributes)
+
+            if 'sequential' == quotaDistribution and len(candidates[subReddits[0]]) == epoch['numOfPosts']:
+                break  # the first subreddit fills the quota, the posts of the next pages would not be used
+
+            if len(candidates[subReddit]) == epoch['numOfPosts']:
+                numOfFullSubReddits += 1
+                if numOfFullSubReddits == len(subReddits):
+                    break  # no need to page further
+
+        return candidates
+
+
+    def takeDeferredPosts(self) -> pd.DataFrame:
+        '''
+        Return the posts deferred since the last call and empty the queue.
+        '''
+        deferredPosts = pd.DataFrame(self._deferredPosts)
+        self._deferredPosts = []
+
+        return deferredPosts
+
+
+    def retryDeferredPosts(self, postAttributes: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Download the images of deferred posts whose host is available again.
+
+        Posts of hosts that are still unavailable are put into the deferred queue again, with their
+        attempts counted. Posts tried maxDeferredAttempts times or deferred first longer than
+        maxDeferredAge ago are given up, so the posts of a host which is gone for good do not stay forever.
+        '''
+        allPostsAttributes = []
+        now = dt.datetime.now().timestamp()
+
+        for attributes in postAttributes.to_dict('records'):
+            Reddit._recordDeferral(attributes)  # posts deferred by an older version have no record yet
+
+            if attributes['deferred_attempts'] >= Reddit.maxDeferredAttempts \
+                    or now - attributes['deferred_utc_time'] >= Reddit.maxDeferredAge.total_seconds():
+                continue  # given up
+
+            if not ImageFetcher.isAvailable(self._getImageUrl(attributes)):
+                self._deferredPosts.append(attributes)
+                continue
+
+            attributes['deferred_attempts'] += 1
+
+            if self._downloadImage(attributes):
+                del attributes['deferred_utc_time'], attributes['deferred_attempts']
+                allPostsAttributes.append(attributes)
 
         return pd.DataFrame(allPostsAttributes)
 
 
+    def _downloadImage(self, attributes: dict) -> bool:
+        '''
+        Download the image of the post into its attributes.
+
+        Return True if the image is available. If the host is unavailable,
+        the post is put into the deferred queue.
+        '''
+        imageUrl = self._getImageUrl(attributes)
+
+        try:
+            image = self._fetcher.fetch(imageUrl)
+
+            if image is None and imageUrl != attributes['url_to_meme']:
+                # thumbnail is missing, fall back to the full image
+                imageUrl = attributes['url_to_meme']
+                image = self._fetcher.fetch(imageUrl)
+
+        except HostUnavailableError:
+            Reddit._recordDeferral(attributes)
+            self._deferredPosts.append(attributes)
+            return False
+
+        if image is None:
+            return False
+
+        attributes['image'] = image
+        if self._thumbnailFirst:
+            attributes['image_source'] = 'full' if imageUrl == attributes['url_to_meme'] else 'thumbnail'
+
+        return True
+
+
+    @staticmethod
+    def _recordDeferral(attributes: dict):
+        '''
+        Record the time of the first deferral of the post, if it was not deferred before.
+        '''
+        if pd.isna(attributes.get('deferred_utc_time')):
+            attributes['deferred_utc_time'] = dt.datetime.now().timestamp()  # seconds since epoch, i.e. UTC
+            attributes['deferred_attempts'] = 0
+
+
+    def _getImageUrl(self, attributes: dict) -> str:
+        '''
+        Return the url of the image to download for the post.
+
+        The thumbnail attribute is an url only if the post has a thumbnail,
+        otherwise it is a placeholder like 'default', 'nsfw' or 'spoiler'.
+        Videos, articles and other links have thumbnails too, so the thumbnail is used only
+        if the post links an image, otherwise the full url has to open as an image.
+        '''
+        thumbnail = attributes['thumbnail']
+
+        if self._thumbnailFirst and isinstance(thumbnail, str) and thumbnail.startswith('http') \
+                and Reddit._linksToImage(attributes):
+            return thumbnail
+
+        return attributes['url_to_meme']
+
+
+    @classmethod
+    def _linksToImage(cls, attributes: dict) -> bool:
+        '''
+        Check whether the post links an image, judging by the extension of its url,
+        or by its host if the url has no extension.
+        '''
+        if True == attributes['is_video']:
+            return False
+
+        url = urlparse(str(attributes['url_to_meme']))
+        extension = splitext(url.path)[1].lower()
+
+        if extension:
+            return extension in cls._imageExtensions  # e.g. .gifv of imgur is a video
+
+        return url.netloc.lower() in cls._imageHosts
+
+
+    def getScores(self, ids: list) -> pd.DataFrame:
+        '''
+        Fetch the current score related attributes of the posts from Reddit.
+        '''
+        refreshedTime = dt.datetime.now().timestamp()  # seconds since epoch, i.e. UTC
+        submissions = self._reddit.info(fullnames=[f"t3_{postId}" for postId in ids])
+
+        scores = [{'id':                 post.id,
+                   'refreshed_utc_time': refreshedTime,
+                   'awards':             post.total_awards_received,
+                   'downs':              post.downs,
+                   'ups':                post.ups,
+                   'score':              post.score,
+                   'comments':           post.num_comments}
+                  for post in submissions]
+
+        return pd.DataFrame(scores)
+
+
     @classmethod
     def _extractAttributes(cls, post) -> dict:
         '''
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import pandas as pd
+import datetime as dt
+import json
+import os
+import time
+
+from data_collection_worker import DataCollectionWorker
+
+
+class TailCollectionWorker(DataCollectionWorker):
+    '''
+    Worker continuously collecting the new posts of the subreddits.
+
+    For each subreddit the creation time of the newest seen post is kept as a high-water mark,
+    every poll queries the posts created after the mark minus indexingLag, because Pushshift
+    indexes some posts late. Posts seen in this window are skipped. Posts go through the same download and
+    processing stages as in batch mode and are flushed into small files when enough of them
+    are buffered or enough time passed. The scores of stored posts are fetched again as they age.
+
+    The state (high-water marks, seen and deferred posts, posts whose score is tracked) is saved
+    after the files of a flush, so a restart continues from the last flush.
+    '''
+    pollInterval = 60                   # seconds between two polls of the subreddits
+    flushInterval = 300                 # maximum number of seconds posts are buffered
+    flushSize = 100                     # number of buffered posts triggering a flush
+    maxPostsPerPoll = 500               # maximum number of posts downloaded from a subreddit in one poll
+    initialLookback = dt.timedelta(hours=1)  # age of the oldest posts collected in the first poll
+    indexingLag = dt.timedelta(minutes=30)   # posts created this long before the high-water mark are queried again
+    scoreRefreshAges = [dt.timedelta(minutes=15),   # ages of the posts when their score is fetched again
+                        dt.timedelta(hours=1),
+                        dt.timedelta(hours=4),
+                        dt.timedelta(hours=24)]
+
+
+    def __init__(self, threadId: int, token):
+        DataCollectionWorker.__init__(self, threadId, token)
+
+        self._tailDirectory = f"{self._outputDirectory}/tail"
+        if not os.path.exists(self._tailDirectory):
+            os.makedirs(self._tailDirectory)
+
+        self._highWaterMarks = {}   # subreddit -> creation time (UTC timestamp) of the newest seen post
+        self._seenPosts = {}        # subreddit -> {id: creation time} of the posts seen within the indexing lag
+        self._trackedPosts = {}     # id -> {'created': UTC timestamp, 'refreshes': number of score refreshes}
+        self._deferredPosts = pd.DataFrame()  # posts deferred while their image host was unavailable
+        self._loadState()
+
+        self._bufferedPosts = []
+        self._bufferedScores = []
+        self._lastFlushTime = dt.datetime.now()
+
+
+    def run(self):
+        '''
+        Poll the subreddits until interrupted, flush the buffered data on exit.
+
+        Errors (e.g. of the Reddit or Pushshift API) are printed and the polling goes on.
+        '''
+        try:
+            while True:
+                pollStartTime = dt.datetime.now()
+
+                for subReddit in self._subReddits:
+                    self._runStep(f"polling r/{subReddit}", self._pollSubreddit, subReddit)
+
+                self._runStep('retrying deferred posts', self._retryTailDeferredPosts)
+                self._runStep('refreshing scores', self._refreshScores)
+
+                if self._isFlushDue():
+                    self._runStep('flushing', self._flush)
+
+                elapsedSeconds = (dt.datetime.now() - pollStartTime).total_seconds()
+                time.sleep(max(0., self.pollInterval - elapsedSeconds))
+
+        finally:
+            self._flush()
+
+
+    @staticmethod
+    def _runStep(description: str, step, *arguments):
+        try:
+            step(*arguments)
+        except Exception as error:
+            print(f"{dt.datetime.now().strftime('%m/%d %H:%M:%S')}: Error while {description}: {error!r}", flush=True)
+
+
+    def _pollSubreddit(self, subReddit: str):
+        '''
+        Download and process the new posts of the subreddit.
+
+        Posts created after the high-water mark minus the indexing lag are queried,
+        those already seen are skipped.
+        '''
+        highWaterMark = self._highWaterMarks.get(subReddit)
+        if highWaterMark is None:
+            highWaterMark = (dt.datetime.now() - self.initialLookback).timestamp()
+
+        windowStart = highWaterMark - self.indexingLag.total_seconds()
+
+        # a copy, the state is only updated once the posts are processed and buffered
+        seenPosts = {postId: created for postId, created in self._seenPosts.get(subReddit, {}).items()
+                     if created >= windowStart}
+
+        epoch = {'start':      dt.datetime.fromtimestamp(windowStart),
+                 'end':        dt.datetime.now(),
+                 'numOfPosts': self.maxPostsPerPoll + len(seenPosts)}  # seen posts do not use up the limit
+
+        # oldest first, so the high-water mark does not skip posts if there are more than maxPostsPerPoll
+        postAttributes = self._interface.getPosts(subReddit, epoch, oldestFirst=True, seenPosts=seenPosts)
+        self._bufferPosts(self._processChunk(postAttributes))
+
+        # if processing raised, the posts are queried again in the next poll
+        self._seenPosts[subReddit] = seenPosts
+        if seenPosts:
+            self._highWaterMarks[subReddit] = max(highWaterMark, max(seenPosts.values()))
+
+
+    def _retryTailDeferredPosts(self):
+        '''
+        Retry the deferred posts, buffer those whose image could be downloaded now.
+        '''
+        self._takeDeferredPosts()
+
+        if not self._deferredPosts.empty:
+            recoveredPosts = self._interface.retryDeferredPosts(self._deferredPosts)
+            self._deferredPosts = self._interface.takeDeferredPosts()
+            self._bufferPosts(self._processChunk(recoveredPosts))
+
+
+    def _takeDeferredPosts(self):
+        '''
+        Move the posts deferred by the interface to the deferred posts of the worker.
+        '''
+        deferredPosts = pd.concat([self._deferredPosts, self._interface.takeDeferredPosts()], ignore_index=True)
+        if not deferredPosts.empty:
+            deferredPosts = deferredPosts.drop_duplicates('id', keep='last').reset_index(drop=True)
+
+        self._deferredPosts = deferredPosts
+
+
+    def _bufferPosts(self, postAttributes: pd.DataFrame):
+        if postAttributes.empty:
+            return
+
+        self._bufferedPosts.append(postAttributes)
+
+        for _, post in postAttributes.iterrows():
+            self._trackedPosts[post['id']] = {'created': post['created_utc_time'], 'refreshes': 0}
+
+
+    def _refreshScores(self):
+        '''
+        Fetch the scores of the tracked posts which reached their next refresh age.
+
+        Posts are no longer tracked after their last refresh.
+        '''
+        now = dt.datetime.now().timestamp()
+
+        dueIds = [postId for postId, post in self._trackedPosts.items()
+                  if now - post['created'] >= self.scoreRefreshAges[post['refreshes']].total_seconds()]
+
+        if not dueIds:
+            return
+
+        scores = self._interface.getScores(dueIds)
+        if not scores.empty:
+            self._bufferedScores.append(scores)
+
+        for postId in dueIds:
+            # refresh ages the post already passed are skipped, one refresh covers them
+            age = now - self._trackedPosts[postId]['created']
+            refreshes = sum(1 for refreshAge in self.scoreRefreshAges if age >= refreshAge.total_seconds())
+
+            if refreshes == len(self.scoreRefreshAges):
+                del self._trackedPosts[postId]
+            else:
+                self._trackedPosts[postId]['refreshes'] = refreshes
+
+
+    def _isFlushDue(self) -> bool:
+        numOfBufferedPosts = sum(len(postAttributes) for postAttributes in self._bufferedPosts)
+        return numOfBufferedPosts >= self.flushSize \
+            or dt.datetime.now() - self._lastFlushTime >= dt.timedelta(seconds=self.flushInterval)
+
+
+    def _flush(self):
+        '''
+        Write the buffered posts and scores into new files, then save the state belonging to them.
+        '''
+        flushTime = dt.datetime.now()
+        flushName = flushTime.strftime('%Y%m%d%H%M%S')
+
+        if self._bufferedPosts:
+            posts = pd.concat(self._bufferedPosts, ignore_index=True)
+            self._writeAtomically(posts, f"{self._tailDirectory}/posts_{flushName}.csv")
+
+        if self._bufferedScores:
+            scores = pd.concat(self._bufferedScores, ignore_index=True)
+            self._writeAtomically(scores, f"{self._tailDirectory}/scores_{flushName}.csv")
+
+        self._saveState()
+
+        if self._bufferedPosts or self._bufferedScores:
+            print(f"{flushTime.strftime('%m/%d %H:%M:%S')}: Stored "
+                  + f"{sum(len(postAttributes) for postAttributes in self._bufferedPosts)} posts and "
+                  + f"{sum(len(scores) for scores in self._bufferedScores)} scores.",
+                  flush=True)
+
+        self._bufferedPosts = []
+        self._bufferedScores = []
+        self._lastFlushTime = flushTime
+
+
+    def _loadState(self):
+        stateFileName = f"{self._tailDirectory}/state.json"
+        if not os.path.exists(stateFileName):
+            return
+
+        with open(stateFileName) as stateFile:
+            state = json.load(stateFile)
+
+        self._highWaterMarks = state['highWaterMarks']
+        self._seenPosts = state.get('seenPosts', {})
+        self._trackedPosts = state['trackedPosts']
+        self._deferredPosts = pd.DataFrame(state.get('deferredPosts', []))
+
+
+    def _saveState(self):
+        '''
+        Write the state into a temporary file and rename it, so the state file is never partially written.
+
+        Deferred posts are saved too, the high-water mark may already be past them.
+        '''
+        self._takeDeferredPosts()
+
+        stateFileName = f"{self._tailDirectory}/state.json"
+        temporaryFileName = f"{stateFileName}.tmp"
+
+        with open(temporaryFileName, 'w') as stateFile:
+            json.dump({'highWaterMarks': self._highWaterMarks,
+                       'seenPosts':      self._seenPosts,
+                       'trackedPosts':   self._trackedPosts,
+                       'deferredPosts':  self._deferredPosts.to_dict('records')},
+                      stateFile, default=TailCollectionWorker._toJson)
+            stateFile.flush()
+            os.fsync(stateFile.fileno())
+
+        os.replace(temporaryFileName, stateFileName)
+        DataCollectionWorker._syncDirectory(self._tailDirectory)
+
+
+    @staticmethod
+    def _toJson(value):
+        '''
+        Convert values json does not know: numpy scalars and objects like the author of a post.
+        '''
+        return value.item() if hasattr(value, 'item') else str(value)